@@ -24,6 +24,9 @@ def main():
         --urls, -u (list[str]): List of URLs to process, each must start with http.
         --out_dir, -o (str): Relative or absolute path to output directory.
         --verbose, -v (int): Level of verbosity, default 0.
+        --no-cache: Clear the on-disk HTTP cache before downloading.
+        --compresslevel (int): zlib level for the EPUB zip, 0-9, default 1.
+        --optimize-images: Downscale wide images and re-encode them as WebP.
         --cookies, -c (str): Cookies to use for requests (e.g., "cookie1=value1; cookie2=value2").
         --epub, -e (str): Output file name (or infer from title if not provided).
         --title, -t (str): Title of the EPUB file (or infer from URL if not provided).
@@ -50,6 +53,24 @@ def main():
     parser.add_argument(
         "--verbose", "-v", type=int, default=0, help="Level of verbosity, default 0"
     )
+    parser.add_argument(
+        "--optimize-images",
+        dest="optimize_images",
+        action="store_true",
+        help="Downscale images wider than 1200px and re-encode them as WebP",
+    )
+    parser.add_argument(
+        "--compresslevel",
+        type=int,
+        default=1,
+        help="zlib compression level for the EPUB zip, 0-9 (default 1, fast)",
+    )
+    parser.add_argument(
+        "--no-cache",
+        dest="no_cache",
+        action="store_true",
+        help="Clear the on-disk HTTP cache before downloading",
+    )
     parser.add_argument(
         "--cookies",
         "-c",